@@ -25,7 +25,7 @@ import requests
 import subprocess
 import sys
 from packaging.version import Version
-from PySide6.QtCore import Qt, QUrl, QStringListModel, QTimer, QSize
+from PySide6.QtCore import Qt, QUrl, QStringListModel, QTimer, QSize, QThread, Signal
 from PySide6.QtGui import QScreen
 from PySide6.QtWidgets import (
     QApplication,
@@ -38,12 +38,25 @@ from PySide6.QtWidgets import (
     QScrollArea,
 )
 from typing import Optional, List
+from stageUpdates import (
+    CONNECTION_ERROR,
+    INVALID,
+    TIMED_OUT,
+    UNCHANGED,
+    checkSource,
+    fetchHosts,
+    normalizeHosts,
+    stageSources,
+)
 from ui_form import Ui_App  # generate ui_form.py: pyside6-uic form.ui -o ui_form.py
 from validateHosts import validateHostsFile
 
 __version__ = "1.3.1"
 
 TIMEOUT = 60
+# (connect, read) timeouts for the background check, kept short so closing Lost doesn't hang on a stalled download
+BACKGROUND_TIMEOUT = (5, 10)
+STAGED_SUFFIX = " (update staged)"
 ALL_EXCEPTIONS = (
     requests.exceptions.RequestException,
     requests.exceptions.ConnectionError,
@@ -184,6 +197,33 @@ class QHTMLWindow(QDialog):
         )
 
 
+class StageUpdatesThread(QThread):
+    # emits (staged, failed), see stageSources
+    staged = Signal(object, object)
+
+    def __init__(self, sources, parent=None):
+        super().__init__(parent)
+        self.sources = sources
+
+    def run(self):
+        # requests sessions aren't thread safe so the background job gets its own
+        threadSession = requests.Session()
+        threadSession.headers.update(session.headers)
+        staged, failed = stageSources(
+            self.sources,
+            lambda url: fetchHosts(
+                threadSession,
+                url,
+                BACKGROUND_TIMEOUT,
+                self.isInterruptionRequested,
+            ),
+            self.isInterruptionRequested,
+        )
+        # the window is closing, don't hand it half a check
+        if not self.isInterruptionRequested():
+            self.staged.emit(staged, failed)
+
+
 class App(QMainWindow):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -226,7 +266,7 @@ class App(QMainWindow):
                 )
                 sys.exit(127)
             self.losts = []
-        elif self.hostsFileParts[1].strip().replace("\n", "").replace("\r", "") == "":
+        elif normalizeHosts(self.hostsFileParts[1]) == "":
             # the warning is there, but there are no losts
             self.losts = []
         elif len(self.hostsFileParts) > 2:
@@ -277,12 +317,23 @@ class App(QMainWindow):
         self.model = QStringListModel()
         self.ui.listView.setModel(self.model)
 
+        # updates that were fetched and validated in the background but NOT applied yet (url -> StagedUpdate)
+        self.stagedUpdates = {}
+        self.stageThread = None
+        self.stageQuietly = False
+
         self.populateListView()
 
         self.ui.saveButton.clicked.connect(self.saveChanges)
         self.ui.removeButton.clicked.connect(self.removeSource)
         self.ui.updateButton.clicked.connect(self.updateSource)
         self.ui.updateAllButton.clicked.connect(self.updateAllSources)
+        self.ui.checkUpdatesButton.clicked.connect(self.checkForUpdates)
+        self.ui.applyStagedButton.clicked.connect(self.applyStagedUpdate)
+        self.ui.applyAllStagedButton.clicked.connect(self.applyAllStagedUpdates)
+
+        # only fetches and validates, nothing gets applied without the user clicking a button
+        self.checkForUpdates(quiet=True)
 
     def maliciousHostsFileWarning(
         self, entries: List[str], hosts: Optional[str] = None
@@ -318,7 +369,7 @@ class App(QMainWindow):
         if indexes:
             data = self.ui.listView.model().data(indexes[0])
             if data:
-                return data
+                return data.removesuffix(STAGED_SUFFIX)
         showCritical(self, "No URL selected", "You need to select a URL!")
 
     def addSource(self):
@@ -381,9 +432,12 @@ class App(QMainWindow):
 
         for i in range(0, len(self.losts), 2):
             if self.losts[i] == f"# LOST URL {url} 192919291222//././././.":
-                try:
-                    contents = session.get(url, timeout=TIMEOUT).text
-                except requests.exceptions.Timeout:
+                check = checkSource(
+                    url,
+                    self.losts[i + 1],
+                    lambda url: fetchHosts(session, url, TIMEOUT),
+                )
+                if check.status == TIMED_OUT:
                     if notUpdateAll:
                         showCritical(
                             self,
@@ -397,23 +451,21 @@ class App(QMainWindow):
                             f"The update for {url} timed out! Please check your internet connection. Update will proceed with the other sources...",
                         )
                     return
-                except ALL_EXCEPTIONS as e:
+                if check.status == CONNECTION_ERROR:
                     if notUpdateAll:
                         showCritical(
                             self,
                             "Connection error!",
-                            f"Connection error! Please try again later.\n{e}",
+                            f"Connection error! Please try again later.\n{check.error}",
                         )
                     else:
                         showCritical(
                             self,
                             "Connection error!",
-                            f"Connection error with {url}! Update will proceed with the other sources...\n{e}",
+                            f"Connection error with {url}! Update will proceed with the other sources...\n{check.error}",
                         )
                     return
-                if contents.strip().replace("\n", "").replace("\r", "") == self.losts[
-                    i + 1
-                ].strip().replace("\n", "").replace("\r", ""):
+                if check.status == UNCHANGED:
                     if notUpdateAll:
                         showInformation(
                             self,
@@ -421,8 +473,7 @@ class App(QMainWindow):
                             "There was nothing to update. If you are SURE that there is an update, try restarting NetworkManager.",
                         )
                     return
-                isValid = validateHostsFile(contents)
-                if not isValid[0]:
+                if check.status == INVALID:
                     if notUpdateAll:
                         showCritical(
                             self,
@@ -436,11 +487,10 @@ class App(QMainWindow):
                             f"One of your hosts files has become invalid: {url}. You will need to stay on the older version of that hosts file. Please contact the hosts file maintainer about this. Update will continue with the other hosts files after you click OK or close this message box.",
                         )
                     return
-                if len(isValid) > 1:
-                    if notUpdateAll:
-                        response = self.maliciousHostsFileWarning(isValid[1], url)
-                    else:
-                        response = self.maliciousHostsFileWarning(isValid[1], url)
+                if check.update.dangerous:
+                    response = self.maliciousHostsFileWarning(
+                        check.update.dangerous, url
+                    )
                     if response == QMessageBox.StandardButton.Abort:
                         showWarning(
                             self,
@@ -448,7 +498,8 @@ class App(QMainWindow):
                             "Please remove the now malicious hosts file!!!",
                         )
                         return
-                self.losts[i + 1] = contents
+                self.losts[i + 1] = check.update.contents
+                self.stagedUpdates.pop(url, None)
                 self.populateListView()
                 self.unsavedChanges = True
                 if notUpdateAll:
@@ -465,6 +516,130 @@ class App(QMainWindow):
             self.updateSource(self.losts[i].split(" ")[3])
         showInformation(self, "Update done", "Done updating!")
 
+    def checkForUpdates(self, quiet: bool = False):
+        if self.stageThread is not None and self.stageThread.isRunning():
+            return
+        # qt gives this function False when the button is clicked, which is exactly what we want
+        self.stageQuietly = quiet
+        sources = [
+            (self.losts[i].split(" ")[3], self.losts[i + 1])
+            for i in range(0, len(self.losts), 2)
+        ]
+        self.stageThread = StageUpdatesThread(sources, self)
+        self.stageThread.staged.connect(self.onUpdatesStaged)
+        self.stageThread.finished.connect(self.onStagingFinished)
+        self.ui.checkUpdatesButton.setEnabled(False)
+        self.ui.checkUpdatesButton.setText("Checking for updates...")
+        self.stageThread.start()
+
+    def onUpdatesStaged(self, staged, failed):
+        # the user might have updated or removed sources while we were fetching, drop anything that's out of date
+        snapshot = dict(self.stageThread.sources)
+        current = {
+            self.losts[i].split(" ")[3]: self.losts[i + 1]
+            for i in range(0, len(self.losts), 2)
+        }
+        self.stagedUpdates = {
+            url: update
+            for url, update in staged.items()
+            if url in current and current[url] == snapshot[url]
+        }
+        self.populateListView()
+        if self.stageQuietly:
+            return
+        if failed:
+            showWarning(
+                self,
+                "Some sources couldn't be checked",
+                "\n".join(f"{url}: {reason}" for url, reason in failed.items()),
+            )
+        if self.stagedUpdates:
+            showInformation(
+                self,
+                "Updates staged",
+                f"{len(self.stagedUpdates)} source(s) have updates ready to apply. Nothing has been applied yet!",
+            )
+        elif not failed:
+            showInformation(
+                self,
+                "Nothing to update",
+                "There was nothing to update. If you are SURE that there is an update, try restarting NetworkManager.",
+            )
+
+    def onStagingFinished(self):
+        self.ui.checkUpdatesButton.setEnabled(True)
+        self.ui.checkUpdatesButton.setText("Check for updates")
+
+    def stopStaging(self):
+        if self.stageThread is not None and self.stageThread.isRunning():
+            # fetchHosts checks this after every chunk, so this usually returns within one BACKGROUND_TIMEOUT.
+            # it can take longer if the thread is stuck resolving DNS, requests timeouts don't cover that
+            self.stageThread.requestInterruption()
+            self.stageThread.wait()
+
+    def applyStagedUpdate(self, url: str = None) -> bool:
+        notApplyAll = False
+        if (
+            isinstance(url, bool) or url is None
+        ):  # qt gives this function False as a parameter for whatever reason...
+            notApplyAll = True
+            url = self.getSelectedURL()
+            if url is None:
+                return False
+
+        if url not in self.stagedUpdates:
+            if notApplyAll:
+                showInformation(
+                    self,
+                    "Nothing staged",
+                    'There is no staged update for that source. Click "Check for updates" first!',
+                )
+            return False
+        update = self.stagedUpdates.pop(url)
+        if update.dangerous:
+            # validated in the background, but the user STILL has to see this!!!
+            response = self.maliciousHostsFileWarning(update.dangerous, url)
+            if response == QMessageBox.StandardButton.Abort:
+                self.populateListView()
+                showWarning(
+                    self,
+                    "Aborted",
+                    "Please remove the now malicious hosts file!!!",
+                )
+                return False
+        for i in range(0, len(self.losts), 2):
+            if self.losts[i] == f"# LOST URL {url} 192919291222//././././.":
+                self.losts[i + 1] = update.contents
+                self.populateListView()
+                self.unsavedChanges = True
+                if notApplyAll:
+                    showInformation(self, "Update done", "Done updating!")
+                return True
+        self.populateListView()
+        if notApplyAll:
+            showWarning(
+                self,
+                "...What",
+                "Idk how to explain this just urgently open a github issue now the url provided to update wasn't found",
+            )
+        return False
+
+    def applyAllStagedUpdates(self):
+        if not self.stagedUpdates:
+            showInformation(
+                self,
+                "Nothing staged",
+                'There are no staged updates. Click "Check for updates" first!',
+            )
+            return
+        applied = 0
+        for url in list(self.stagedUpdates):
+            if self.applyStagedUpdate(url):
+                applied += 1
+        showInformation(
+            self, "Update done", f"Done updating! Applied {applied} staged update(s)."
+        )
+
     def removeSource(self):
         url = self.getSelectedURL()
         if url is None:
@@ -473,20 +648,34 @@ class App(QMainWindow):
             if url in self.losts[i]:
                 self.losts.pop(i)
                 self.losts.pop(i)
+                self.stagedUpdates.pop(url, None)
                 self.populateListView()
                 self.unsavedChanges = True
                 return
 
     def populateListView(self):
+        # setStringList resets the model and clears the selection, so remember what was selected
+        selected = self.ui.listView.selectionModel().selectedIndexes()
+        selectedURL = (
+            self.model.data(selected[0]).removesuffix(STAGED_SUFFIX)
+            if selected
+            else None
+        )
         urls = []
+        selectedRow = None
         for i in range(0, len(self.losts), 2):
             url_comment = self.losts[i]
             match = re.search(
                 r"# LOST URL (https?://\S+) 192919291222//\./\./\./\./\.", url_comment
             )
             if match:
-                urls.append(match.group(1))
+                url = match.group(1)
+                if url == selectedURL:
+                    selectedRow = len(urls)
+                urls.append(url + STAGED_SUFFIX if url in self.stagedUpdates else url)
         self.model.setStringList(urls)
+        if selectedRow is not None:
+            self.ui.listView.setCurrentIndex(self.model.index(selectedRow))
 
     def saveChanges(self):
         new_hosts_file = self.hostsFileParts[0] + self.HOSTS_SEPARATOR
@@ -520,6 +709,8 @@ class App(QMainWindow):
                 event.ignore()  # user clicked cancel or closed the message box -- don't exit
         else:
             event.accept()  # exit
+        if event.isAccepted():
+            self.stopStaging()
 
 
 if __name__ == "__main__":
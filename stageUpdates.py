@@ -0,0 +1,151 @@
+import requests
+import urllib3
+from validateHosts import validateHostsFile
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+TIMED_OUT = "timed out"
+CONNECTION_ERROR = "connection error"
+UNCHANGED = "unchanged"
+INVALID = "invalid"
+UPDATED = "updated"
+
+
+class FetchCancelled(Exception):
+    """
+    Raised by fetchHosts when the download gets cancelled halfway through.
+    """
+
+
+class StagedUpdate(NamedTuple):
+    """
+    A new version of a source that has been fetched and validated, but NOT applied yet.
+
+    `dangerous` holds the potentially malicious entries found by validateHostsFile (or None if there aren't any).
+    **The user still has to be warned about those before the update gets applied!!!!!**
+    """
+
+    contents: str
+    dangerous: Optional[List[str]]
+
+
+class SourceCheck(NamedTuple):
+    """
+    The result of checkSource.
+
+    `status` is one of TIMED_OUT, CONNECTION_ERROR, UNCHANGED, INVALID or UPDATED.
+    `update` is only set for UPDATED, and `error` is only set for CONNECTION_ERROR.
+    """
+
+    status: str
+    update: Optional[StagedUpdate] = None
+    error: Optional[Exception] = None
+
+
+def normalizeHosts(data) -> str:
+    """
+    This strips the whitespace and line breaks out of a hosts file so two versions can be compared.
+    """
+    return data.strip().replace("\n", "").replace("\r", "")
+
+
+def fetchHosts(
+    session: requests.Session,
+    url: str,
+    timeout,
+    isCancelled: Callable[[], bool] = lambda: False,
+) -> str:
+    """
+    This downloads a hosts file in chunks, checking `isCancelled` after every chunk
+    so a huge download can be stopped without waiting for it to finish.
+
+    Raises FetchCancelled if it gets cancelled, and requests exceptions if the download fails.
+    The contents are decoded the same way requests' Response.text does it.
+    """
+    with session.get(url, timeout=timeout, stream=True) as response:
+        chunks = []
+        try:
+            for chunk in response.iter_content(chunk_size=65536):
+                if isCancelled():
+                    raise FetchCancelled(url)
+                chunks.append(chunk)
+        except requests.exceptions.ConnectionError as e:
+            # requests turns read timeouts in the middle of a stream into ConnectionErrors
+            if e.args and isinstance(e.args[0], urllib3.exceptions.ReadTimeoutError):
+                raise requests.exceptions.ReadTimeout(e) from e
+            raise
+        data = b"".join(chunks)
+        encoding = response.encoding
+        if encoding is None:
+            encoding = requests.compat.chardet.detect(data)["encoding"]
+        try:
+            return str(data, encoding, errors="replace")
+        except (LookupError, TypeError):
+            # bogus (or no) charset, just like Response.text
+            return str(data, errors="replace")
+
+
+def checkSource(url: str, current: str, fetch: Callable[[str], str]) -> SourceCheck:
+    """
+    This downloads a source with `fetch`, compares it to the `current` contents and validates it.
+
+    It does NOT touch the hosts file or ask the user anything, that's up to whoever called it.
+    FetchCancelled is NOT caught.
+    """
+    try:
+        contents = fetch(url)
+    except requests.exceptions.Timeout:
+        return SourceCheck(TIMED_OUT)
+    except requests.exceptions.RequestException as e:
+        return SourceCheck(CONNECTION_ERROR, error=e)
+    if normalizeHosts(contents) == normalizeHosts(current):
+        return SourceCheck(UNCHANGED)
+    isValid = validateHostsFile(contents)
+    if not isValid[0]:
+        return SourceCheck(INVALID)
+    return SourceCheck(
+        UPDATED, StagedUpdate(contents, isValid[1] if len(isValid) > 1 else None)
+    )
+
+
+def stageSources(
+    sources: List[Tuple[str, str]],
+    fetch: Callable[[str], str],
+    isCancelled: Callable[[], bool] = lambda: False,
+) -> Tuple[Dict[str, StagedUpdate], Dict[str, str]]:
+    """
+    This takes a list of (url, current contents) pairs and a function that downloads a url,
+    and returns two dicts.
+
+    The first dict maps urls to their StagedUpdate, for every source that has a new VALID version.
+    Sources with nothing to update don't show up in either dict.
+
+    The second dict maps urls to the reason they couldn't be staged (connection errors, invalid hosts files, etc).
+
+    This does NOT touch the hosts file or ask the user anything, so it's safe to run in the background.
+    `isCancelled` is checked before every source so a background job can be stopped early. If `fetch`
+    raises FetchCancelled, this stops too.
+
+    Anything else that goes wrong with a source is recorded in the second dict, so one broken source
+    doesn't throw away the results of all the others.
+    """
+    staged = {}
+    failed = {}
+    for url, current in sources:
+        if isCancelled():
+            break
+        try:
+            check = checkSource(url, current, fetch)
+        except FetchCancelled:
+            break
+        except Exception as e:
+            failed[url] = f"Something went wrong: {e!r}"
+            continue
+        if check.status == TIMED_OUT:
+            failed[url] = "The request timed out."
+        elif check.status == CONNECTION_ERROR:
+            failed[url] = f"Connection error: {check.error}"
+        elif check.status == INVALID:
+            failed[url] = "The new version of the hosts file is invalid."
+        elif check.status == UPDATED:
+            staged[url] = check.update
+    return staged, failed
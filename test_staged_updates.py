@@ -0,0 +1,207 @@
+from stageUpdates import (
+    FetchCancelled,
+    TIMED_OUT,
+    UNCHANGED,
+    UPDATED,
+    checkSource,
+    fetchHosts,
+    stageSources,
+)
+import requests
+import urllib3
+
+
+def fakeFetch(responses):
+    def fetch(url):
+        response = responses[url]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    return fetch
+
+
+def test_stages_new_valid_version():
+    staged, failed = stageSources(
+        [("https://example.com/hosts", "0.0.0.0 a.com\n")],
+        fakeFetch({"https://example.com/hosts": "0.0.0.0 a.com\n0.0.0.0 b.com\n"}),
+    )
+    assert (
+        staged["https://example.com/hosts"].contents == "0.0.0.0 a.com\n0.0.0.0 b.com\n"
+    )
+    assert staged["https://example.com/hosts"].dangerous is None
+    assert not failed
+
+
+def test_skips_unchanged_source():
+    staged, failed = stageSources(
+        [("https://example.com/hosts", "0.0.0.0 a.com\n")],
+        fakeFetch({"https://example.com/hosts": "\r\n0.0.0.0 a.com\r\n"}),
+    )
+    assert not staged
+    assert not failed
+
+
+def test_does_not_stage_invalid_version():
+    staged, failed = stageSources(
+        [("https://example.com/hosts", "0.0.0.0 a.com\n")],
+        fakeFetch({"https://example.com/hosts": "a.com 0.0.0.0\n"}),
+    )
+    assert not staged
+    assert "https://example.com/hosts" in failed
+
+
+def test_keeps_dangerous_entries_for_the_user():
+    staged, failed = stageSources(
+        [("https://example.com/hosts", "0.0.0.0 a.com\n")],
+        fakeFetch({"https://example.com/hosts": "0.0.0.0 a.com\n8.8.8.8 b.com\n"}),
+    )
+    assert staged["https://example.com/hosts"].dangerous == ["8.8.8.8 b.com"]
+    assert not failed
+
+
+def test_connection_errors_dont_stop_other_sources():
+    staged, failed = stageSources(
+        [
+            ("https://example.com/timeout", ""),
+            ("https://example.com/broken", ""),
+            ("https://example.com/hosts", ""),
+        ],
+        fakeFetch(
+            {
+                "https://example.com/timeout": requests.exceptions.Timeout(),
+                "https://example.com/broken": requests.exceptions.ConnectionError(),
+                "https://example.com/hosts": "0.0.0.0 a.com\n",
+            }
+        ),
+    )
+    assert list(staged) == ["https://example.com/hosts"]
+    assert set(failed) == {"https://example.com/timeout", "https://example.com/broken"}
+
+
+def test_stops_when_cancelled():
+    staged, failed = stageSources(
+        [("https://example.com/hosts", "")],
+        fakeFetch({"https://example.com/hosts": "0.0.0.0 a.com\n"}),
+        lambda: True,
+    )
+    assert not staged
+    assert not failed
+
+
+class FakeResponse:
+    encoding = "utf-8"
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iter_content(self, chunk_size):
+        yield from self.chunks
+
+
+class FakeSession:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def get(self, url, timeout, stream):
+        return FakeResponse(self.chunks)
+
+
+def test_fetch_joins_chunks():
+    session = FakeSession([b"0.0.0.0 a.com\n", b"0.0.0.0 b.com\n"])
+    assert (
+        fetchHosts(session, "https://example.com/hosts", 10)
+        == "0.0.0.0 a.com\n0.0.0.0 b.com\n"
+    )
+
+
+def test_fetch_cancels_mid_download():
+    session = FakeSession([b"0.0.0.0 a.com\n", b"0.0.0.0 b.com\n"])
+    try:
+        fetchHosts(session, "https://example.com/hosts", 10, lambda: True)
+    except FetchCancelled:
+        pass
+    else:
+        assert False, "the download should have been cancelled"
+
+
+def test_cancelled_fetch_stops_staging():
+    def fetch(url):
+        raise FetchCancelled(url)
+
+    staged, failed = stageSources(
+        [("https://example.com/a", ""), ("https://example.com/b", "")], fetch
+    )
+    assert not staged
+    assert not failed
+
+
+def test_check_source():
+    fetch = fakeFetch({"https://example.com/hosts": "0.0.0.0 a.com\n"})
+    assert (
+        checkSource("https://example.com/hosts", "0.0.0.0 a.com", fetch).status
+        == UNCHANGED
+    )
+    check = checkSource("https://example.com/hosts", "", fetch)
+    assert check.status == UPDATED
+    assert check.update.contents == "0.0.0.0 a.com\n"
+
+
+def test_unexpected_error_doesnt_stop_other_sources():
+    staged, failed = stageSources(
+        [("https://example.com/broken", ""), ("https://example.com/hosts", "")],
+        fakeFetch(
+            {
+                "https://example.com/broken": LookupError("unknown encoding: x-bogus"),
+                "https://example.com/hosts": "0.0.0.0 a.com\n",
+            }
+        ),
+    )
+    assert list(staged) == ["https://example.com/hosts"]
+    assert "x-bogus" in failed["https://example.com/broken"]
+
+
+def test_fetch_falls_back_on_bogus_encoding():
+    session = FakeSession([b"0.0.0.0 a.com\n"])
+    FakeResponse.encoding = "x-bogus"
+    try:
+        assert fetchHosts(session, "https://example.com/hosts", 10) == "0.0.0.0 a.com\n"
+    finally:
+        FakeResponse.encoding = "utf-8"
+
+
+def test_fetch_detects_missing_encoding():
+    HOSTS = "".join(f"0.0.0.0 ads{i}.example.com\n" for i in range(50))
+    session = FakeSession([HOSTS.encode()])
+    FakeResponse.encoding = None
+    try:
+        assert fetchHosts(session, "https://example.com/hosts", 10) == HOSTS
+    finally:
+        FakeResponse.encoding = "utf-8"
+
+
+def test_stalled_stream_is_a_timeout():
+    class StalledResponse(FakeResponse):
+        def iter_content(self, chunk_size):
+            yield b"0.0.0.0 a.com\n"
+            raise requests.exceptions.ConnectionError(
+                urllib3.exceptions.ReadTimeoutError(None, None, "Read timed out.")
+            )
+
+    class StalledSession(FakeSession):
+        def get(self, url, timeout, stream):
+            return StalledResponse(self.chunks)
+
+    session = StalledSession([])
+    check = checkSource(
+        "https://example.com/hosts",
+        "",
+        lambda url: fetchHosts(session, url, 10),
+    )
+    assert check.status == TIMED_OUT